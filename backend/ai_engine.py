@@ -1,29 +1,78 @@
 # backend/ai_engine.py
-import json, re, requests
+import asyncio, os, fastjsonschema, httpx, orjson
+from cachetools import TTLCache
 
 OLLAMA_URL = "http://127.0.0.1:11434/api/generate"
 MODEL = "mistral"  # or your local choice
 
+# LLM_BACKEND=llama.cpp points at a llama-server (lower per-call latency,
+# grammar-constrained output); default stays Ollama.
+BACKEND = os.getenv("LLM_BACKEND", "ollama")
+LLAMA_CPP_URL = os.getenv("LLAMA_CPP_URL", "http://127.0.0.1:8080/completion")
+
+# Shared async HTTP client (opened/closed by main.py startup/shutdown events)
+# so every Ollama call reuses one connection pool instead of a fresh socket.
+_CLIENT: httpx.AsyncClient | None = None
+
+def get_client() -> httpx.AsyncClient:
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        _CLIENT = httpx.AsyncClient(
+            timeout=60,
+            http2=True,
+            # Keep sockets to loopback Ollama alive between requests — the
+            # TCP setup otherwise dominates for small generate bodies.
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+            # compressed responses + multiplexed streams on one connection
+            headers={"Content-Type": "application/json",
+                     "Accept-Encoding": "gzip, deflate"},
+        )
+    return _CLIENT
+
+async def close_client():
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+        _CLIENT = None
+
+def _range_schema():
+    return {
+        "type": "array",
+        "items": {"type": "number", "minimum": 0, "maximum": 1},
+        "minItems": 2, "maxItems": 2,
+    }
+
 SCHEMA = {
     "type": "object",
     "properties": {
         "mood": {"type": "string"},
-        "scene": {"type": "string"},
-        "tempo_bpm": {"type": "integer"},
-        "energy_range": {"type": "array", "items": {"type": "number"}, "minItems": 2, "maxItems": 2},
-        "valence_range": {"type": "array", "items": {"type": "number"}, "minItems": 2, "maxItems": 2},
-        "danceability_range": {"type": "array", "items": {"type": "number"}, "minItems": 2, "maxItems": 2},
-        "acousticness_range": {"type": "array", "items": {"type": "number"}, "minItems": 2, "maxItems": 2},
+        "scene": {"type": "string", "default": ""},
+        "tempo_bpm": {"type": "integer", "minimum": 40, "maximum": 220},
+        "energy_range": _range_schema(),
+        "valence_range": _range_schema(),
+        "danceability_range": _range_schema(),
+        "acousticness_range": _range_schema(),
         "genre_candidates": {"type": "array", "items": {"type": "string"}},
-        "keywords": {"type": "array", "items": {"type": "string"}}
+        "keywords": {"type": "array", "items": {"type": "string"}, "default": []},
     },
     "required": ["mood","tempo_bpm","energy_range","valence_range","danceability_range","acousticness_range","genre_candidates"],
 }
 
+# Compiled once at import: one codegen'd pass validates bounds and fills
+# defaults, vs. ~10 Python-level .get/min/max calls per request.
+_VALIDATE = fastjsonschema.compile(SCHEMA, use_default=True)
+
+_PARAM_KEYS = (
+    "mood", "scene", "tempo_bpm", "energy_range", "valence_range",
+    "danceability_range", "acousticness_range", "genre_candidates", "keywords",
+)
+
+# Plain string with a single {vibe} marker — split once at import and joined
+# by concat per request, so the 1.5 KB template is never re-scanned.
 PROMPT_TEMPLATE = """You are a music curation assistant. Convert the user's vibe description into JSON **only** (no extra text).
 The JSON must follow this schema (numbers in [0,1], tempo 40–220):
 
-{{
+{
   "mood": "<short phrase>",
   "scene": "<optional short context>",
   "tempo_bpm": <int 40-220>,
@@ -33,7 +82,7 @@ The JSON must follow this schema (numbers in [0,1], tempo 40–220):
   "acousticness_range": [<0-1>, <0-1>],
   "genre_candidates": ["<up to 6 genres>"],
   "keywords": ["<3-8 short search keywords (no artist names unless explicitly requested)>"]
-}}
+}
 
 Notes:
 - Favor CONCRETE Spotify-like genre names when possible: pop, rock, metal, death-metal, metalcore, hardcore, hip-hop, r-n-b, electronic, house, techno, indie-pop, alternative, ambient, chill, chillhop, lofi, jazz, soul, funk, trap, punk, folk, singer-songwriter, edm, drum-and-bass.
@@ -43,46 +92,197 @@ Notes:
 User vibe: "{vibe}"
 """
 
-def _coerce_ranges(d, key, default=(0.5,0.5)):
-    try:
-        a,b = d.get(key, default)
-        a = float(a); b = float(b)
-        a = max(0.0, min(1.0, a)); b = max(0.0, min(1.0, b))
-        return [a,b]
-    except Exception:
-        return list(default)
+_PROMPT_PRE, _PROMPT_POST = PROMPT_TEMPLATE.split("{vibe}")
+
+# GBNF grammar mirroring SCHEMA — llama-server can only emit an object of
+# this shape, so extraction/fallback never kicks in on that backend.
+JSON_GRAMMAR = r"""
+root ::= "{" ws "\"mood\":" ws string "," ws "\"scene\":" ws string "," ws "\"tempo_bpm\":" ws int "," ws "\"energy_range\":" ws range "," ws "\"valence_range\":" ws range "," ws "\"danceability_range\":" ws range "," ws "\"acousticness_range\":" ws range "," ws "\"genre_candidates\":" ws strlist "," ws "\"keywords\":" ws strlist ws "}"
+range ::= "[" ws num ws "," ws num ws "]"
+strlist ::= "[" ws (string (ws "," ws string)*)? ws "]"
+string ::= "\"" ([^"\\] | "\\" .)* "\""
+int ::= [0-9]+
+num ::= [0-9] ("." [0-9]+)?
+ws ::= [ \t\n]*
+"""
 
-def _extract_json(text):
-    # grab the first {...} block
-    m = re.search(r"\{.*\}", text, re.S)
-    return m.group(0) if m else "{}"
+async def _call_ollama(prompt: str) -> str:
+    # format:"json" constrains generation to parseable JSON — no preamble
+    # tokens to pay for and nothing to extract afterwards. Stream the tokens
+    # and hang up as soon as the top-level object closes, so any trailing
+    # output the app would discard is never generated or buffered.
+    body = {
+        "model": MODEL,
+        "prompt": prompt,
+        "format": "json",
+        "options": {"temperature": 0.4},
+        "stream": True,
+    }
+    buf: list[str] = []
+    depth = 0
+    started = False
+    # orjson (de)serializes the wire payloads — C-speed and bytes-native
+    async with get_client().stream("POST", OLLAMA_URL, content=orjson.dumps(body)) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            if not line:
+                continue
+            try:
+                chunk = orjson.loads(line)
+            except Exception:
+                continue
+            piece = chunk.get("response", "")
+            if piece:
+                buf.append(piece)
+                for c in piece:
+                    if c == "{":
+                        depth += 1
+                        started = True
+                    elif c == "}":
+                        depth -= 1
+                        if started and depth == 0:
+                            return "".join(buf)  # closing the stream drops the rest
+            if chunk.get("done"):
+                break
+    return "".join(buf)
 
-def analyze_vibe_to_json(vibe: str) -> dict:
-    prompt = PROMPT_TEMPLATE.format(vibe=vibe.strip())
-    body = {"model": MODEL, "prompt": prompt, "temperature": 0.4, "stream": False}
-    r = requests.post(OLLAMA_URL, json=body, timeout=60)
+async def _call_llama_cpp(prompt: str) -> str:
+    body = {"prompt": prompt, "n_predict": 400, "temperature": 0.4, "grammar": JSON_GRAMMAR}
+    r = await get_client().post(LLAMA_CPP_URL, content=orjson.dumps(body))
     r.raise_for_status()
-    raw = r.json().get("response","")
+    return orjson.loads(r.content).get("content", "")
+
+def _coerce_ranges(d, key, default=(0.5,0.5)):
+    v = d.get(key)
+    if isinstance(v, (list, tuple)) and len(v) == 2:
+        a, b = v
+        # Fast path: well-formed model output needs no clamping and no
+        # exception machinery — just guarded checks
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)) \
+                and 0.0 <= a <= 1.0 and 0.0 <= b <= 1.0:
+            return [float(a), float(b)]
+        try:
+            a = float(a); b = float(b)
+        except Exception:
+            return list(default)
+        return [max(0.0, min(1.0, a)), max(0.0, min(1.0, b))]
+    return list(default)
+
+# Memoize analyses: the function is pure w.r.t. the vibe text, so repeat
+# prompts (UI retries, demos) skip the multi-second Ollama round-trip.
+_VIBE_CACHE: TTLCache = TTLCache(maxsize=512, ttl=3600)
+_VIBE_CACHE_LOCK = asyncio.Lock()
+
+# Degenerate prompts (empty, or a bare genre name) don't need a model call —
+# synthesize params locally from per-genre tempo/energy presets.
+_GENRE_PRESETS = {
+    "pop": (112, (0.6, 0.8)),
+    "rock": (120, (0.6, 0.9)),
+    "metal": (130, (0.7, 0.95)),
+    "punk": (160, (0.8, 1.0)),
+    "edm": (126, (0.7, 0.95)),
+    "house": (124, (0.6, 0.9)),
+    "techno": (130, (0.7, 0.95)),
+    "trance": (138, (0.7, 0.9)),
+    "dance": (120, (0.6, 0.9)),
+    "electronic": (120, (0.6, 0.9)),
+    "hip-hop": (95, (0.5, 0.8)),
+    "trap": (140, (0.5, 0.8)),
+    "r-n-b": (90, (0.4, 0.7)),
+    "soul": (95, (0.4, 0.7)),
+    "funk": (105, (0.5, 0.8)),
+    "jazz": (100, (0.3, 0.6)),
+    "blues": (90, (0.3, 0.6)),
+    "chill": (90, (0.2, 0.5)),
+    "ambient": (70, (0.1, 0.4)),
+    "classical": (80, (0.1, 0.4)),
+    "piano": (80, (0.1, 0.4)),
+    "acoustic": (95, (0.2, 0.5)),
+    "country": (105, (0.4, 0.7)),
+    "folk": (100, (0.3, 0.6)),
+    "indie-pop": (110, (0.5, 0.8)),
+    "alt-rock": (120, (0.6, 0.9)),
+    "reggae": (85, (0.4, 0.7)),
+    "latin": (105, (0.6, 0.9)),
+    "k-pop": (115, (0.6, 0.9)),
+    "dubstep": (140, (0.7, 0.95)),
+    "drum-and-bass": (172, (0.8, 1.0)),
+}
+
+def _static_params(mood="mix", tempo=100, energy=(0.5, 0.7), genres=()):
+    # fresh lists every call — callers mutate these dicts
+    return {
+        "mood": mood,
+        "scene": "",
+        "tempo_bpm": tempo,
+        "energy_range": list(energy),
+        "valence_range": [0.4, 0.7],
+        "danceability_range": [0.4, 0.7],
+        "acousticness_range": [0.2, 0.6],
+        "genre_candidates": list(genres),
+        "keywords": list(genres),
+    }
+
+async def analyze_vibe_to_json(vibe: str) -> dict:
+    key = " ".join(vibe.lower().split())
+    if not key:
+        return _static_params()
+    if key in _GENRE_PRESETS:
+        tempo, energy = _GENRE_PRESETS[key]
+        return _static_params(mood=key, tempo=tempo, energy=energy, genres=[key])
+    async with _VIBE_CACHE_LOCK:
+        cached = _VIBE_CACHE.get(key)
+    if cached is not None:
+        return dict(cached)  # copy so callers can't mutate the cached entry
+
+    prompt = _PROMPT_PRE + vibe.strip() + _PROMPT_POST
+    if BACKEND == "llama.cpp":
+        raw = await _call_llama_cpp(prompt)
+    else:
+        raw = await _call_ollama(prompt)
     try:
-        data = json.loads(_extract_json(raw))
+        data = orjson.loads(raw)
     except Exception:
         data = {}
+    if not isinstance(data, dict):
+        # format:"json" only guarantees valid JSON, not an object — a
+        # top-level array/string/number must still hit the coercion defaults
+        data = {}
 
-    # Coerce and defaults
-    out = {
-        "mood": data.get("mood") or "mix",
-        "scene": data.get("scene") or "",
-        "tempo_bpm": max(40, min(220, int(data.get("tempo_bpm") or 100))),
-        "energy_range": _coerce_ranges(data, "energy_range", (0.5,0.7)),
-        "valence_range": _coerce_ranges(data, "valence_range", (0.4,0.7)),
-        "danceability_range": _coerce_ranges(data, "danceability_range", (0.4,0.7)),
-        "acousticness_range": _coerce_ranges(data, "acousticness_range", (0.2,0.6)),
-        "genre_candidates": data.get("genre_candidates") or [],
-        "keywords": data.get("keywords") or [],
-    }
-    return out
+    try:
+        # Fast path: one compiled validator pass over well-formed output
+        valid = _VALIDATE(data)
+        out = {k: valid[k] for k in _PARAM_KEYS}
+    except fastjsonschema.JsonSchemaException:
+        # Slow path: coerce and clamp whatever the model gave us
+        out = {
+            "mood": data.get("mood") or "mix",
+            "scene": data.get("scene") or "",
+            "tempo_bpm": max(40, min(220, int(data.get("tempo_bpm") or 100))),
+            "energy_range": _coerce_ranges(data, "energy_range", (0.5,0.7)),
+            "valence_range": _coerce_ranges(data, "valence_range", (0.4,0.7)),
+            "danceability_range": _coerce_ranges(data, "danceability_range", (0.4,0.7)),
+            "acousticness_range": _coerce_ranges(data, "acousticness_range", (0.2,0.6)),
+            "genre_candidates": data.get("genre_candidates") or [],
+            "keywords": data.get("keywords") or [],
+        }
+    # Don't pin hard-coded defaults for an hour when the model returned
+    # nothing usable (timeout, empty/garbled response) — let retries re-analyze
+    if data:
+        async with _VIBE_CACHE_LOCK:
+            _VIBE_CACHE[key] = out
+    return dict(out)
+
+async def analyze_vibes_batch(vibes: list[str]) -> list[dict]:
+    """
+    Analyze several vibes in one shot. The calls share the pooled client and
+    run concurrently, so Ollama batches the forward passes (set
+    OLLAMA_NUM_PARALLEL > 1 server-side) instead of N serial round-trips.
+    """
+    return list(await asyncio.gather(*(analyze_vibe_to_json(v) for v in vibes)))
 
-def generate_playlist_prompt(vibe: str) -> str:
-    # simple text preview for your current UI
-    d = analyze_vibe_to_json(vibe)
+async def generate_playlist_prompt(vibe: str, params: dict | None = None) -> str:
+    # simple text preview for your current UI; pass precomputed params to
+    # skip a second analysis of the same vibe
+    d = params if params is not None else await analyze_vibe_to_json(vibe)
     return f"{d['mood']} • tempo≈{d['tempo_bpm']} • genres={', '.join(d['genre_candidates'][:4]) or 'auto'}"
\ No newline at end of file
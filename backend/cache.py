@@ -0,0 +1,53 @@
+# backend/cache.py
+# Tiny Redis-backed JSON cache so the Spotify lookups survive restarts and
+# are shared across uvicorn workers. Degrades to a no-op (callers keep their
+# in-memory dicts) when Redis isn't installed or reachable.
+import os
+
+import orjson
+
+try:
+    import redis
+except ImportError:  # optional dependency
+    redis = None
+
+CACHE_TTL = int(os.getenv("CACHE_TTL", "86400"))
+
+_client = None
+_disabled = redis is None
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis(
+            host=os.getenv("REDIS_HOST", "127.0.0.1"),
+            port=int(os.getenv("REDIS_PORT", "6379")),
+            db=int(os.getenv("REDIS_DB", "0")),
+            socket_connect_timeout=1,
+            socket_timeout=1,
+        )
+    return _client
+
+
+def cache_get_json(key: str):
+    global _disabled
+    if _disabled:
+        return None
+    try:
+        raw = _get_client().get(key)
+        return orjson.loads(raw) if raw else None
+    except Exception:
+        # Redis unreachable — stop trying for this process
+        _disabled = True
+        return None
+
+
+def cache_set_json(key: str, value, ttl: int = CACHE_TTL):
+    global _disabled
+    if _disabled:
+        return
+    try:
+        _get_client().setex(key, ttl, orjson.dumps(value))
+    except Exception:
+        _disabled = True
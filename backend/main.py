@@ -1,24 +1,31 @@
 # backend/main.py
+import asyncio
 import os
-import requests
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import RedirectResponse
+import threading
+import time
+from fastapi import Body, FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, RedirectResponse
 from starlette.middleware.cors import CORSMiddleware
 from fastapi import Query
 from typing import List
+from cachetools import TTLCache
 
 
-from .ai_engine import analyze_vibe_to_json, generate_playlist_prompt
+from .ai_engine import (
+    analyze_vibe_to_json, analyze_vibes_batch, generate_playlist_prompt,
+    get_client, close_client,
+)
 from .spotify_client import (
     oauth, exchange_code_for_token, get_spotify,
-    recommend_tracks, create_playlist, add_tracks, get_genre_hero,
+    recommend_tracks, create_playlist, add_tracks, get_genre_hero, get_genre_heroes,
+    prime_genre_hero_cache, prewarm_genre_heroes,
     normalize_genres_for_debug, allowed_genres_for_debug,  # <-- debug wrappers
 )
 
 # Allow overriding the frontend URL (useful if you run on a different port/host)
 FRONTEND_BASE = os.getenv("FRONTEND_BASE", "http://localhost:3000")
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,6 +35,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Frontends poll the health routes on a timer; probe Ollama in the background
+# every 5 s and serve the cached answer instead of one outbound call per poll.
+_OLLAMA_HEALTH = {"ok": False, "ts": 0.0, "error": "not checked yet"}
+_OLLAMA_POLL_TASK: asyncio.Task | None = None
+
+async def _poll_ollama():
+    while True:
+        try:
+            r = await get_client().get("http://127.0.0.1:11434/api/tags", timeout=3)
+            r.raise_for_status()
+            _OLLAMA_HEALTH.update(ok=True, ts=time.time(), error=None)
+        except Exception as e:
+            _OLLAMA_HEALTH.update(ok=False, ts=time.time(), error=str(e))
+        await asyncio.sleep(5)
+
+@app.on_event("startup")
+async def startup():
+    # Open the shared async HTTP client used for Ollama calls
+    get_client()
+    global _OLLAMA_POLL_TASK
+    _OLLAMA_POLL_TASK = asyncio.create_task(_poll_ollama())
+    # Pull any persisted genre heroes into memory so the UI's initial view
+    # is served without Spotify round-trips after a restart
+    await asyncio.to_thread(prime_genre_hero_cache)
+
+@app.on_event("shutdown")
+async def shutdown():
+    if _OLLAMA_POLL_TASK is not None:
+        _OLLAMA_POLL_TASK.cancel()
+    await close_client()
+
 # -------- Basic & health routes --------
 
 @app.get("/")
@@ -39,35 +77,49 @@ def health():
     return {"ok": True}
 
 @app.get("/health/ollama")
-def health_ollama():
-    try:
-        r = requests.get("http://127.0.0.1:11434/api/tags", timeout=3)
-        r.raise_for_status()
-        return {"ok": True, "ollama": True}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ollama not reachable: {e}")
+async def health_ollama():
+    if not _OLLAMA_HEALTH["ok"]:
+        raise HTTPException(status_code=500, detail=f"Ollama not reachable: {_OLLAMA_HEALTH['error']}")
+    return {"ok": True, "ollama": True}
+
+# Same idea for Spotify, but connection state is per user — cache briefly
+_SPOTIFY_HEALTH_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=5)
 
 @app.get("/health/spotify")
 def health_spotify(username: str | None = None):
     # Simple check: is this user connected?
     if not username:
         return {"ok": True, "connected": False}
+    cached = _SPOTIFY_HEALTH_CACHE.get(username)
+    if cached is not None:
+        return cached
     try:
         sp = get_spotify(username)
         me = sp.me()
-        return {"ok": True, "connected": True, "user": me.get("id")}
+        out = {"ok": True, "connected": True, "user": me.get("id")}
     except Exception:
-        return {"ok": True, "connected": False}
+        out = {"ok": True, "connected": False}
+    _SPOTIFY_HEALTH_CACHE[username] = out
+    return out
 
 # -------- Preview & params --------
 
 @app.post("/playlist")  # text preview for UI
-def create_playlist_preview(prompt: str):
-    return {"playlist_query": generate_playlist_prompt(prompt)}
+async def create_playlist_preview(prompt: str):
+    # Return the params alongside the preview so the frontend can hand them
+    # back to /playlist/create and skip a second LLM call
+    params = await analyze_vibe_to_json(prompt)
+    return {"playlist_query": await generate_playlist_prompt(prompt, params), "params": params}
 
 @app.post("/vibe/params")  # structured params for recs
-def vibe_params(prompt: str):
-    return analyze_vibe_to_json(prompt)
+async def vibe_params(prompt: str):
+    return await analyze_vibe_to_json(prompt)
+
+@app.post("/vibe/params/batch")  # precompute params for several saved prompts
+async def vibe_params_batch(prompts: List[str]):
+    if not prompts:
+        raise HTTPException(400, "prompts list is empty")
+    return {"results": await analyze_vibes_batch(prompts)}
 
 # -------- Spotify OAuth (PoC: pass ?username=yourname) --------
 
@@ -91,6 +143,12 @@ def spotify_callback(code: str, state: str):
     try:
         username = state.split("-")[0] if "-" in state else state
         exchange_code_for_token(state, code, username)
+        # First connected user can prewarm the default-genre heroes —
+        # best-effort, off the request path
+        threading.Thread(
+            target=lambda: prewarm_genre_heroes(get_spotify(username)),
+            daemon=True,
+        ).start()
         # Redirect back to the frontend with a marker
         return RedirectResponse(url=f"{FRONTEND_BASE}?connected={username}")
     except Exception as e:
@@ -100,24 +158,39 @@ def spotify_callback(code: str, state: str):
 
 # -------- Spotify helper endpoints for the UI --------
 
+# Baseline seeds served if Spotify bounces with 404/intermittent errors, so
+# the UI still works. Built once at import — broad & common, known valid.
+FALLBACK_GENRES: tuple[str, ...] = tuple(sorted({
+    "pop","hip-hop","r-n-b","electronic","dance","house","edm","indie-pop","alt-rock",
+    "rock","metal","punk","trap","chill","ambient","jazz","soul","blues",
+    "country","folk","singer-songwriter","k-pop","latin","afrobeat","reggae",
+    "classical","piano","acoustic","psych-rock","emo","grunge","new-wave","synth-pop",
+    "drum-and-bass","dubstep","garage","techno","trance","hardstyle"
+}))
+_FALLBACK_GENRE_SET = frozenset(FALLBACK_GENRES)
+
+# Genre list barely changes; cache it per user so UI loads skip the round-trip.
+# _ALLOWED_GENRE_SETS holds frozensets for O(1) membership checks downstream.
+_GENRES_CACHE: TTLCache = TTLCache(maxsize=256, ttl=300)
+_ALLOWED_GENRE_SETS: TTLCache = TTLCache(maxsize=1024, ttl=900)
+
+def _allowed_genre_set(username: str, sp) -> frozenset:
+    s = _ALLOWED_GENRE_SETS.get(username)
+    if s is None:
+        s = frozenset(allowed_genres_for_debug(sp)) or _FALLBACK_GENRE_SET
+        _ALLOWED_GENRE_SETS[username] = s
+    return s
+
 @app.get("/spotify/genres")
 def spotify_genres(username: str):
-    sp = get_spotify(username)
+    cached = _GENRES_CACHE.get(username)
+    if cached is not None:
+        return {"genres": cached}
 
-    # Try live list
-    genres = allowed_genres_for_debug(sp)
-
-    # If Spotify bounces with 404/intermittent errors, serve a baseline so UI still works
-    if not genres:
-        genres = [
-            # broad & common seeds known to be valid
-            "pop","hip-hop","r-n-b","electronic","dance","house","edm","indie-pop","alt-rock",
-            "rock","metal","punk","trap","chill","ambient","jazz","soul","blues",
-            "country","folk","singer-songwriter","k-pop","latin","afrobeat","reggae",
-            "classical","piano","acoustic","psych-rock","emo","grunge","new-wave","synth-pop",
-            "drum-and-bass","dubstep","garage","techno","trance","hardstyle"
-        ]
-    return {"genres": sorted(set(genres))}
+    sp = get_spotify(username)
+    out = sorted(_allowed_genre_set(username, sp))
+    _GENRES_CACHE[username] = out
+    return {"genres": out}
 
 # @app.get("/spotify/genres")
 # def spotify_genres(username: str):
@@ -175,17 +248,18 @@ def spotify_genres(username: str):
 def search_artists(username: str, q: str, limit: int = 8):
     sp = get_spotify(username)
     res = sp.search(q=q, type="artist", limit=min(max(limit, 1), 12), market="US")
-    artists = []
-    for a in res.get("artists", {}).get("items", []):
-        img = (a.get("images") or [{}])[0].get("url")
-        artists.append({
+    items = res["artists"]["items"] if res.get("artists") else []
+    artists = [
+        {
             "id": a.get("id"),
             "name": a.get("name"),
-            "image": img,
-            "genres": a.get("genres", []),
+            "image": a["images"][0]["url"] if a.get("images") else None,
+            "genres": a.get("genres") or [],
             "popularity": a.get("popularity"),
-            "url": a.get("external_urls", {}).get("spotify"),
-        })
+            "url": (a.get("external_urls") or {}).get("spotify"),
+        }
+        for a in items
+    ]
     return {"artists": artists}
 
 @app.get("/spotify/genre_hero")
@@ -202,18 +276,18 @@ def spotify_genre_hero(username: str, genre: str):
         raise HTTPException(500, f"Failed to fetch genre hero: {e}")
 
 @app.get("/spotify/genre_heroes")
-def spotify_genre_heroes(username: str, genres: str):
+async def spotify_genre_heroes(username: str, genres: str):
     """
     Batch version: genres is a comma-separated list.
     Returns: { "pop": {...}, "edm": {...}, ... }
     """
     try:
-        sp = get_spotify(username)
-        out = {}
-        for g in [x.strip() for x in (genres or "").split(",") if x.strip()]:
-            hero = get_genre_hero(sp, g)
-            if hero:
-                out[g] = hero
+        # get_spotify can block on a token-refresh round-trip — keep it off
+        # the loop along with the lookup itself
+        sp = await asyncio.to_thread(get_spotify, username)
+        genres_list = [x.strip() for x in (genres or "").split(",") if x.strip()]
+        # Batched lookup: uncached genres share OR-query searches (~N/5 calls)
+        out = await asyncio.to_thread(get_genre_heroes, sp, genres_list)
         if not out:
             raise HTTPException(404, "No heroes found for provided genres")
         return out
@@ -259,7 +333,7 @@ def spotify_genre_heroes(username: str, genres: str):
 #         # Safety net so FE always gets a clear message
 #         raise HTTPException(status_code=500, detail=f"Playlist creation failed: {e}")
 @app.post("/playlist/create")
-def playlist_create(
+async def playlist_create(
     prompt: str,
     username: str,
     public: bool = False,
@@ -267,13 +341,16 @@ def playlist_create(
     artist_ids: str | None = None,
     energy: float | None = None,   # ✅ NEW
     limit: int = Query(15, ge=1, le=50),   # ✅ default 15, clamp 1–50
+    params: dict | None = Body(None),  # ✅ precomputed params from /playlist
 ):
     try:
         if not prompt.strip():
             raise HTTPException(400, "Prompt is required")
 
         # analyze the user's vibe prompt → structured parameters
-        params = analyze_vibe_to_json(prompt)
+        # (skipped when the frontend posts the params it got from /playlist)
+        if params is None:
+            params = await analyze_vibe_to_json(prompt)
 
         # ✅ apply user-selected energy target
         if energy is not None:
@@ -292,16 +369,18 @@ def playlist_create(
             params["user_artist_ids"] = user_artist_ids
 
         # ✅ authenticate and fetch Spotify client
-        sp = get_spotify(username)
-        me = sp.me()
+        # Spotipy is sync; run its calls in the threadpool so the loop stays free
+        sp = await asyncio.to_thread(get_spotify, username)
+        me = await asyncio.to_thread(sp.me)
 
         # ✅ limit to 15 songs (or user-specified within 1–50)
-        uris = recommend_tracks(sp, params, n=limit)
+        uris = await asyncio.to_thread(recommend_tracks, sp, params, n=limit)
         if not uris:
             raise HTTPException(400, "No tracks found for parameters")
 
-        # ✅ create the playlist
-        pl_id = create_playlist(
+        # ✅ create the playlist (the response already includes the share URL)
+        pl_id, url = await asyncio.to_thread(
+            create_playlist,
             sp,
             me["id"],
             name=f"VibeList • {params.get('mood', 'mix')}",
@@ -310,10 +389,8 @@ def playlist_create(
         )
 
         # ✅ add up to the same number of tracks (limit)
-        add_tracks(sp, pl_id, uris[:limit])
+        await asyncio.to_thread(add_tracks, sp, pl_id, uris[:limit])
 
-        # ✅ fetch and return playlist URL
-        url = sp.playlist(pl_id)["external_urls"]["spotify"]
         return {"playlist_url": url, "count": min(len(uris), limit), "params": params}
 
     except HTTPException:
@@ -325,12 +402,14 @@ def playlist_create(
 # -------- Debug helpers (optional) --------
 
 @app.get("/debug/normalize")
-def debug_normalize(prompt: str, username: str = "benijah"):
+async def debug_normalize(prompt: str, username: str = "benijah"):
     # Requires the user to be connected first (token in memory)
-    sp = get_spotify(username)
-    params = analyze_vibe_to_json(prompt)
-    seeds = normalize_genres_for_debug(sp, params.get("genre_candidates") or params.get("genres", []))
-    allowed_sample = allowed_genres_for_debug(sp)[:30]
+    sp = await asyncio.to_thread(get_spotify, username)
+    params = await analyze_vibe_to_json(prompt)
+    seeds = await asyncio.to_thread(
+        normalize_genres_for_debug, sp, params.get("genre_candidates") or params.get("genres", [])
+    )
+    allowed_sample = (await asyncio.to_thread(allowed_genres_for_debug, sp))[:30]
     return {"raw_params": params, "normalized_seeds": seeds, "allowed_sample": allowed_sample}
 
 @app.get("/spotify/whoami")
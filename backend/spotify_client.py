@@ -1,16 +1,27 @@
 # backend/spotify_client.py
+import itertools
 import os
 import re
 import random
+import threading
+import time
+import types
 from pathlib import Path
 from typing import List, Dict
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import lru_cache
+import ahocorasick
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from spotipy import Spotify
 from spotipy.oauth2 import SpotifyOAuth
 from spotipy.exceptions import SpotifyException
 
+from .cache import cache_get_json, cache_set_json
+
 
 # --- Load .env from THIS folder explicitly ---
 ENV_PATH = Path(__file__).with_name(".env")
@@ -18,11 +29,11 @@ load_dotenv(dotenv_path=ENV_PATH)
 
 SCOPES = "playlist-modify-public playlist-modify-private user-read-email"
 DEFAULT_MARKET = "US"
-DEFAULT_SEED_GENRES = [
+DEFAULT_SEED_GENRES: frozenset[str] = frozenset({
     "pop", "dance-pop", "edm", "house", "hip-hop", "r-n-b",
     "indie-pop", "alt-rock", "trap", "electronic", "chill",
     "ambient", "dancehall", "reggaeton", "funk", "soul"
-]
+})
 
 def _get_env(primary: str, alt: str | None = None) -> str:
     """Read env var with optional fallback name (supports SPOTIFY_* or SPOTIPY_*)."""
@@ -57,40 +68,94 @@ def exchange_code_for_token(state: str, code: str, username: str):
         raise RuntimeError("Spotify OAuth failed: no access_token in response.")
     TOKENS[username] = token_info
 
+# One refresh in flight per user: concurrent requests racing on an expired
+# token would each call refresh_access_token, wasting quota and risking the
+# refresh_token rotating out from under one of them.
+_REFRESH_LOCKS: Dict[str, threading.Lock] = {}
+_REFRESH_LOCKS_GUARD = threading.Lock()
+
+def _refresh_lock(username: str) -> threading.Lock:
+    with _REFRESH_LOCKS_GUARD:
+        lock = _REFRESH_LOCKS.get(username)
+        if lock is None:
+            lock = _REFRESH_LOCKS[username] = threading.Lock()
+        return lock
+
+# One pooled session for all Spotify traffic: a fresh Spotify() per call
+# renegotiates TCP+TLS to api.spotify.com every time. Pool sizes leave room
+# for the thread fan-outs without "connection pool is full" warnings.
+_SHARED_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(pool_connections=20, pool_maxsize=50)
+_SHARED_SESSION.mount("https://", _ADAPTER)
+_SHARED_SESSION.mount("http://", _ADAPTER)
+
+# {username: (access_token, Spotify)} — rebuilt only when the token rotates
+_SP_CLIENTS: Dict[str, tuple] = {}
+
+# Refresh a minute before expiry so an API call never stalls on a refresh
+# that could have happened ahead of time.
+_TOKEN_SKEW = 60
+
+def _token_needs_refresh(token_info: dict) -> bool:
+    return token_info.get("expires_at", 0) - time.time() < _TOKEN_SKEW
+
 def get_spotify(username: str) -> Spotify:
     token_info = TOKENS.get(username)
     if not token_info:
         raise RuntimeError("No Spotify token; user not connected.")
-    sp_oauth = oauth("refresh")
-    if sp_oauth.is_token_expired(token_info):
-        token_info = sp_oauth.refresh_access_token(token_info["refresh_token"])
-        TOKENS[username] = token_info
-    return Spotify(auth=token_info["access_token"])
+    if _token_needs_refresh(token_info):
+        sp_oauth = oauth("refresh")
+        with _refresh_lock(username):
+            # double-check: a racing request may have refreshed while we waited
+            token_info = TOKENS[username]
+            if _token_needs_refresh(token_info):
+                token_info = sp_oauth.refresh_access_token(token_info["refresh_token"])
+                TOKENS[username] = token_info
+
+    access_token = token_info["access_token"]
+    cached = _SP_CLIENTS.get(username)
+    if cached is not None and cached[0] == access_token:
+        return cached[1]
+    sp = Spotify(auth=access_token, requests_session=_SHARED_SESSION)
+    _SP_CLIENTS[username] = (access_token, sp)
+    return sp
 
 # ---------- Playlist helpers (these were missing!) ----------
-def create_playlist(sp: Spotify, user_id: str, name: str, public: bool = False, description: str = "") -> str:
+def create_playlist(sp: Spotify, user_id: str, name: str, public: bool = False, description: str = "") -> tuple[str, str]:
+    """Returns (playlist_id, shareable_url) — the create response already
+    carries the URL, so callers don't need a follow-up playlist fetch."""
     pl = sp.user_playlist_create(user=user_id, name=name, public=public, description=description)
-    return pl["id"]
+    return pl["id"], (pl.get("external_urls") or {}).get("spotify", "")
 
 def add_tracks(sp: Spotify, playlist_id: str, uris: List[str]):
     if uris:
         sp.playlist_add_items(playlist_id, uris)
 
 # ----------------- RECS HELPERS -----------------
+
+# Cap concurrent Spotify calls across all thread fan-outs so we stay
+# comfortably under the rate limit.
+_SPOTIFY_SEM = threading.Semaphore(8)
+
+def _fetch_limited(fn, *args, **kwargs):
+    with _SPOTIFY_SEM:
+        return fn(*args, **kwargs)
+
+def _chunks(xs, k=50):
+    return (xs[i:i + k] for i in range(0, len(xs), k))
+
 def _clamp01(x, default=0.5):
+    # keep the try around the conversion only — the common case (a float
+    # already in range) falls through the comparisons without it
     try:
-        return max(0.0, min(1.0, float(x)))
+        x = float(x)
     except Exception:
         return default
+    return 0.0 if x < 0.0 else (1.0 if x > 1.0 else x)
 
-_ALLOWED_GENRES_CACHE: set[str] | None = None
-DEFAULT_SEED_GENRES = {
-    "pop", "dance-pop", "edm", "house", "hip-hop", "r-n-b",
-    "indie-pop", "alt-rock", "trap", "electronic", "chill",
-    "ambient", "dancehall", "reggaeton", "funk", "soul"
-}
+_ALLOWED_GENRES_CACHE: frozenset[str] | None = None
 
-def _allowed_genres(sp: Spotify) -> set[str]:
+def _allowed_genres(sp: Spotify) -> frozenset[str]:
     """
     Load Spotify's genre seeds. Works across Spotipy versions.
     Falls back to DEFAULT_SEED_GENRES and caches result.
@@ -99,6 +164,12 @@ def _allowed_genres(sp: Spotify) -> set[str]:
     if _ALLOWED_GENRES_CACHE:
         return _ALLOWED_GENRES_CACHE
 
+    # Cross-process/restart cache — the seed list changes ~never
+    cached = cache_get_json("spotify:genre_seeds")
+    if cached:
+        _ALLOWED_GENRES_CACHE = frozenset(cached)
+        return _ALLOWED_GENRES_CACHE
+
     try:
         # Spotipy has used both names across versions
         if hasattr(sp, "recommendation_genre_seeds"):
@@ -109,17 +180,53 @@ def _allowed_genres(sp: Spotify) -> set[str]:
             seeds = seeds.get("genres", [])
         seeds = list(seeds or [])
         if seeds:
-            _ALLOWED_GENRES_CACHE = set(seeds)
+            _ALLOWED_GENRES_CACHE = frozenset(seeds)
+            cache_set_json("spotify:genre_seeds", seeds, ttl=86400)
             return _ALLOWED_GENRES_CACHE
     except Exception as e:
         print(f"[genres] failed to fetch seeds: {e}")
 
     # Hard fallback so we ALWAYS have something
-    _ALLOWED_GENRES_CACHE = set(DEFAULT_SEED_GENRES)
+    _ALLOWED_GENRES_CACHE = DEFAULT_SEED_GENRES
     return _ALLOWED_GENRES_CACHE
 
+_TOKEN_RE = re.compile(r"[^a-z\-]+")
+
 def _split_tokens(s: str) -> list[str]:
-    return [t for t in re.split(r"[^a-z\-]+", s.lower()) if t]
+    return [t for t in _TOKEN_RE.split(s.lower()) if t]
+
+# Read-only view so the mapping is built once and can't drift at runtime
+_SYNONYMS = types.MappingProxyType({
+    "lofi": "chillhop", "lo-fi": "chillhop",
+    "hiphop": "hip-hop", "hip-hop": "hip-hop",
+    "rnb": "r-n-b", "r&b": "r-n-b",
+    "indiepop": "indie-pop", "alt": "alternative",
+    "altrock": "alt-rock", "electro": "electronic",
+    "dance": "dance-pop", "party": "dance-pop",
+    "workout": "edm", "club": "house",
+    "reggae": "dancehall"
+})
+
+@lru_cache(maxsize=512)
+def _norm_cached(tokens_key: tuple, allowed: frozenset) -> tuple:
+    # Single pass: map synonyms, keep allowed seeds, dedupe, cap at 5
+    seen: set[str] = set()
+    valid: list[str] = []
+    for t in tokens_key:
+        t = _SYNONYMS.get(t, t)
+        if t in allowed and t not in seen:
+            seen.add(t)
+            valid.append(t)
+            if len(valid) == 5:
+                break
+
+    if not valid:
+        # Defaults chosen to cover both chill and uptempo use cases
+        for g in ("dance-pop", "edm", "hip-hop", "indie-pop", "pop", "house", "trap"):
+            if g in allowed:
+                valid.append(g)
+        valid = valid[:5]
+    return tuple(valid)
 
 def _normalize_genre_list(sp: Spotify, genres) -> list[str]:
     allowed = _allowed_genres(sp) or DEFAULT_SEED_GENRES
@@ -132,32 +239,9 @@ def _normalize_genre_list(sp: Spotify, genres) -> list[str]:
             if isinstance(g, str):
                 tokens.extend(_split_tokens(g))
 
-    synonyms = {
-        "lofi": "chillhop", "lo-fi": "chillhop",
-        "hiphop": "hip-hop", "hip-hop": "hip-hop",
-        "rnb": "r-n-b", "r&b": "r-n-b",
-        "indiepop": "indie-pop", "alt": "alternative",
-        "altrock": "alt-rock", "electro": "electronic",
-        "dance": "dance-pop", "party": "dance-pop",
-        "workout": "edm", "club": "house",
-        "reggae": "dancehall"
-    }
-
-    cleaned, seen = [], set()
-    for t in tokens:
-        t = synonyms.get(t, t)
-        if t and t not in seen:
-            seen.add(t)
-            cleaned.append(t)
-
-    valid = [g for g in cleaned if g in allowed]
-    if not valid:
-        # Defaults chosen to cover both chill and uptempo use cases
-        for g in ["dance-pop", "edm", "hip-hop", "indie-pop", "pop", "house", "trap"]:
-            if g in allowed:
-                valid.append(g)
-        valid = valid[:5]
-    return valid[:5]
+    # Memoized on (tokens, allowed) — both hashable, and repeat vibes hit
+    # the cache without re-running the synonym/filter pass
+    return list(_norm_cached(tuple(tokens), allowed))
 
 def _jitter(val: float | None, spread=0.15):
     if val is None:
@@ -168,18 +252,19 @@ def _jitter(val: float | None, spread=0.15):
 
 def _keywords_to_seed_tracks(sp: Spotify, keywords: list[str], max_tracks=3) -> list[str]:
     seeds: list[str] = []
+    kws = keywords[:3]
+    if not kws:
+        return seeds
     try:
-        for kw in keywords[:3]:
-            q = f'track:"{kw}"' if " " in kw else kw
-            res = sp.search(q=q, type="track", limit=2, market=DEFAULT_MARKET)
-            items = res.get("tracks", {}).get("items", [])
-            for t in items:
-                if t.get("id"):
-                    seeds.append(t["id"])
-                    if len(seeds) >= max_tracks:
-                        break
-            if len(seeds) >= max_tracks:
-                break
+        # One OR query covers all keywords in a single round-trip
+        q = " OR ".join(f'track:"{kw}"' if " " in kw else kw for kw in kws)
+        res = sp.search(q=q, type="track", limit=6, market=DEFAULT_MARKET)
+        for t in res.get("tracks", {}).get("items", []):
+            tid = t.get("id")
+            if tid and tid not in seeds:
+                seeds.append(tid)
+                if len(seeds) >= max_tracks:
+                    break
     except Exception:
         pass
     return seeds
@@ -188,11 +273,15 @@ def _artist_seed_genres(sp: Spotify, artist_ids: list[str], limit: int = 2) -> l
     """Look up each artist's genres and convert to valid Spotify seed genre names."""
     raw = []
     for aid in artist_ids[:3]:
-        try:
-            a = sp.artist(aid)
-            raw.extend(a.get("genres") or [])
-        except Exception:
-            pass
+        genres = cache_get_json(f"spotify:artist_genres:{aid}")
+        if genres is None:
+            try:
+                a = sp.artist(aid)
+                genres = a.get("genres") or []
+                cache_set_json(f"spotify:artist_genres:{aid}", genres, ttl=86400)
+            except Exception:
+                genres = []
+        raw.extend(genres)
     # Normalize to Spotify's allowed seeds and cap
     return _normalize_genre_list(sp, raw)[:limit]
 
@@ -205,6 +294,17 @@ _BLOCK_TERMS = {
 # Allow famous legit exceptions (avoid nuking real songs like Purple Rain)
 _EXCEPT_PHRASES = {"purple rain"}
 
+# One Aho-Corasick automaton over the block terms and their no-space forms
+# ("white noise" / "whitenoise") — built once, queried with a single linear
+# scan per title in _audio_feature_filter
+_SFX_AUTOMATON = ahocorasick.Automaton()
+for _t in _BLOCK_TERMS:
+    _SFX_AUTOMATON.add_word(_t, _t)
+    _ns = _t.replace(" ", "")
+    if _ns != _t:
+        _SFX_AUTOMATON.add_word(_ns, _ns)
+_SFX_AUTOMATON.make_automaton()
+
 def _looks_like_sfx(track_or_name: dict | str) -> bool:
     """Heuristic: titles/albums that are obviously SFX/white-noise/etc."""
     if isinstance(track_or_name, dict):
@@ -217,29 +317,22 @@ def _looks_like_sfx(track_or_name: dict | str) -> bool:
     if any(p in hay for p in _EXCEPT_PHRASES):
         return False
 
-    # avoid false positives like "Brainstorm"
-    tokens = {t.strip() for t in re.split(r"[^a-z]+", hay)}
-    if any(term.replace(" ", "") in tokens for term in {t.replace(" ", "") for t in _BLOCK_TERMS}):
-        return True
+    # one linear scan instead of token-set + phrase passes
+    return next(_SFX_AUTOMATON.iter(hay), None) is not None
 
-    # also catch phrases
-    for term in _BLOCK_TERMS:
-        if term in hay:
-            return True
-    return False
 
-
-def _audio_feature_filter(sp: Spotify, uris: list[str], params: dict) -> list[str]:
+def _audio_feature_filter(sp: Spotify, uris: list[str], params: dict, *, meta=None, feats=None):
     """
     Remove obvious SFX/ambient/podcast tracks, and loosely enforce the vibe:
       - prefer vocals (instrumentalness < 0.85) unless 'instrumental_ok' is true
       - cut super-long soundscapes (> 10 min)
       - avoid speechy/podcast content (speechiness >= 0.66)
       - loosely keep tempo/energy within plausible window if provided
-    Returns filtered URIs (keeps order).
+    Returns (filtered_uris, meta, feats); pass meta/feats from a previous
+    call over the same uris to re-run the predicates without re-fetching.
     """
     if not uris:
-        return uris
+        return uris, meta, feats
 
     instrumental_ok = bool(params.get("instrumental_ok", False))
     vocals_required = params.get("vocals_required", not instrumental_ok)
@@ -252,11 +345,21 @@ def _audio_feature_filter(sp: Spotify, uris: list[str], params: dict) -> list[st
 
     # Fetch track meta first to title-filter cheaply
     # (Spotipy accepts a list of track IDs, so convert)
+    # /tracks and /audio-features cap at 50 ids — chunk bigger bags and
+    # fetch the chunks concurrently instead of truncating or erroring
     ids = [u.split(":")[-1] for u in uris]
-    try:
-        meta = sp.tracks(ids).get("tracks", []) or []
-    except Exception:
-        meta = []
+    if meta is None:
+        try:
+            chunks = list(_chunks(ids))
+            if len(chunks) == 1:
+                meta = sp.tracks(chunks[0]).get("tracks", []) or []
+            else:
+                with ThreadPoolExecutor(max_workers=4) as ex:
+                    meta = list(itertools.chain.from_iterable(
+                        ex.map(lambda c: _fetch_limited(sp.tracks, c).get("tracks", []) or [], chunks)
+                    ))
+        except Exception:
+            meta = []
 
     keep_mask = [True] * len(uris)
 
@@ -268,50 +371,96 @@ def _audio_feature_filter(sp: Spotify, uris: list[str], params: dict) -> list[st
         except Exception:
             pass
 
-    # Audio-feature filter (batch)
-    try:
-        feats = sp.audio_features(ids)
-    except Exception:
-        feats = None
+    # Only fetch audio features for title-filter survivors — the cheap check
+    # already discarded the rest, so don't pay for their feature payloads
+    keep_idx = [i for i, ok in enumerate(keep_mask) if ok]
+    if not keep_idx:
+        return [], meta, feats
+    keep_uris = [uris[i] for i in keep_idx]
+    keep_ids = [ids[i] for i in keep_idx]
+
+    # Audio-feature filter (batch). The title filter is deterministic in
+    # meta, so cached feats from a prior call line up with keep_ids.
+    if feats is None:
+        try:
+            chunks = list(_chunks(keep_ids))
+            if len(chunks) == 1:
+                feats = sp.audio_features(chunks[0])
+            else:
+                with ThreadPoolExecutor(max_workers=4) as ex:
+                    feats = list(itertools.chain.from_iterable(
+                        ex.map(lambda c: _fetch_limited(sp.audio_features, c) or [], chunks)
+                    ))
+        except Exception:
+            feats = None
 
     if feats:
-        for i, f in enumerate(feats):
-            if not keep_mask[i] or not f:
-                continue
-
-            instrumentalness = f.get("instrumentalness")
-            speechiness = f.get("speechiness")
-            energy = f.get("energy")
+        # Vectorize the predicate checks over the whole batch. Missing
+        # feature dicts/values get pass-safe sentinels so they're kept,
+        # matching the old per-track None handling.
+        mid_tempo = float(tempo_lo) if tempo_lo is not None else 0.0
+
+        def _row(f):
+            if not f:
+                return (0.0, 0.0, 1.0, mid_tempo, 0)
             tempo = f.get("tempo")
-            duration_ms = f.get("duration_ms") or 0
+            energy = f.get("energy")
+            return (
+                f.get("instrumentalness") or 0.0,
+                f.get("speechiness") or 0.0,
+                1.0 if energy is None else energy,
+                mid_tempo if tempo is None else tempo,
+                f.get("duration_ms") or 0,
+            )
+
+        arr = np.array(
+            [_row(feats[i] if i < len(feats) else None) for i in range(len(keep_uris))],
+            dtype=[("inst", "f4"), ("sp", "f4"), ("en", "f4"), ("tp", "f4"), ("du", "i4")],
+        )
+        mask = (arr["du"] < 10 * 60 * 1000) & (arr["sp"] < 0.66) & (arr["en"] > 0.03)
+        if vocals_required:
+            mask &= arr["inst"] < 0.85
+        if tempo_lo is not None and tempo_hi is not None:
+            mask &= (arr["tp"] >= tempo_lo - 8) & (arr["tp"] <= tempo_hi + 8)
+        return [u for u, ok in zip(keep_uris, mask.tolist()) if ok], meta, feats
 
-            # Kill extremely long soundscapes
-            if duration_ms >= 10 * 60 * 1000:
-                keep_mask[i] = False
-                continue
+    return keep_uris, meta, feats
 
-            # Avoid podcasts, spoken word
-            if speechiness is not None and speechiness >= 0.66:
-                keep_mask[i] = False
-                continue
+def _recommendations_with_fallback(sp: Spotify, base_kwargs: dict, bag: dict) -> bool:
+    """
+    Try the recommendations endpoint in a few compatible shapes:
+    1) with 'market'
+    2) with 'country'
+    3) with neither (let API infer)
+    Success = we got any tracks back.
+    """
+    # Drop the Nones once; variants are cheap copies of this
+    base = {k: v for k, v in base_kwargs.items() if v is not None}
 
-            # Prefer vocals unless caller says instrumentals are okay
-            if vocals_required and instrumentalness is not None and instrumentalness >= 0.85:
-                keep_mask[i] = False
-                continue
+    # 2) swap market -> country (or add country if no market was provided)
+    k2 = base.copy()
+    k2["country"] = k2.pop("market", DEFAULT_MARKET)
 
-            # Extremely low energy → likely ambient pad
-            if energy is not None and energy <= 0.03:
-                keep_mask[i] = False
-                continue
+    # 3) neither market nor country
+    k3 = {k: v for k, v in base.items() if k not in ("market", "country")}
 
-            # Keep tempo within a loose window if set
-            if tempo is not None and tempo_lo is not None and tempo_hi is not None:
-                if tempo < tempo_lo - 8 or tempo > tempo_hi + 8:
-                    keep_mask[i] = False
-                    continue
+    variants = [base, k2, k3]
 
-    return [u for u, ok in zip(uris, keep_mask) if ok]
+    for payload in variants:
+        try:
+            recs = sp.recommendations(**payload)
+            items = recs.get("tracks", []) or []
+            for t in items:
+                u = t.get("uri")
+                if u:
+                    bag[u] = None
+            if items:
+                return True
+        except SpotifyException:
+            continue
+        except Exception:
+            continue
+    return False
 
 # ----------------- RECOMMENDER -----------------
 # spotify_client.py (only this function needs to change if you already have the helpers from earlier)
@@ -330,9 +479,10 @@ def recommend_tracks(sp: Spotify, params: dict, n: int = 40) -> list[str]:
     # Targets
     def mid(pair, default=0.5):
         try:
-            return max(0.0, min(1.0, sum(pair) / 2))
+            x = (pair[0] + pair[1]) * 0.5
         except Exception:
             return default
+        return 0.0 if x < 0.0 else (1.0 if x > 1.0 else x)
 
     energy_center       = mid(params.get("energy_range", [0.5, 0.5]))
     valence_center      = mid(params.get("valence_range", [0.5, 0.5]))
@@ -353,19 +503,23 @@ def recommend_tracks(sp: Spotify, params: dict, n: int = 40) -> list[str]:
 
     # GUARANTEE: at least one valid seed, no matter what
     if not seed_artists and not seed_genres:
-        allowed = _allowed_genres(sp) or set(DEFAULT_SEED_GENRES)
+        allowed = _allowed_genres(sp) or DEFAULT_SEED_GENRES
         # bias toward upbeat seeds for high energy prompts
         upbeat_pref = ["dance-pop", "edm", "house", "pop", "hip-hop"]
         picked = [g for g in upbeat_pref if g in allowed] or list(allowed)
         seed_genres = [picked[0]]
 
-    # Assemble seeds dict (Spotipy accepts lists)
+    # Assemble seeds dict (Spotipy accepts lists); count as we go so the
+    # seed-track check below doesn't re-derive the total from the dict
     seeds = {}
+    seed_total = 0
     if seed_artists:
         seeds["seed_artists"] = seed_artists[: max(0, 5)]
+        seed_total += len(seeds["seed_artists"])
     if seed_genres and len(seed_artists) < 5:
         room = 5 - len(seed_artists)
         seeds["seed_genres"] = seed_genres[:room]
+        seed_total += len(seeds["seed_genres"])
 
     # ---- call recs with jitter (variety) ----
     def _j(x, spread=0.12):
@@ -388,84 +542,26 @@ def recommend_tracks(sp: Spotify, params: dict, n: int = 40) -> list[str]:
 
     kw_seeds = _keywords_to_seed_tracks(sp, params.get("keywords", []), max_tracks=2)
     if kw_seeds and "seed_tracks" not in kwargs and random.random() < 0.6:
-        current_seed_count = len(seeds.get("seed_artists", [])) + len(seeds.get("seed_genres", []))
-        room = max(0, 5 - current_seed_count)
+        room = 5 - seed_total
         if room > 0:
             kwargs["seed_tracks"] = kw_seeds[:1]  # keep it to 1 to be safe
 
-    bag, seen = [], set()
-
-    def _add_from_recs(base_kwargs: dict) -> bool:
-        """
-        Try the recommendations endpoint in a few compatible shapes:
-        1) with 'market'
-        2) with 'country'
-        3) with neither (let API infer)
-        Success = we got any tracks back.
-        """
-        variants = []
-
-        # 1) as-is (market)
-        variants.append({k: v for k, v in base_kwargs.items() if v is not None})
-
-        # 2) swap market -> country
-        if "market" in base_kwargs:
-            k2 = base_kwargs.copy()
-            val = k2.pop("market", None)
-            if val:
-                k2["country"] = val
-            variants.append({k: v for k, v in k2.items() if v is not None})
-        else:
-            # if no market provided, also try adding country explicitly
-            k2 = base_kwargs.copy()
-            k2["country"] = DEFAULT_MARKET
-            variants.append({k: v for k, v in k2.items() if v is not None})
-
-        # 3) neither market nor country
-        k3 = {k: v for k, v in base_kwargs.items() if k not in ("market", "country")}
-        variants.append({k: v for k, v in k3.items() if v is not None})
-
-        for payload in variants:
-            try:
-                recs = sp.recommendations(**payload)
-                items = recs.get("tracks", []) or []
-                for t in items:
-                    u = t.get("uri")
-                    if u and u not in seen:
-                        seen.add(u)
-                        bag.append(u)
-                if items:
-                    return True
-            except SpotifyException:
-                continue
-            except Exception:
-                continue
-        return False
-    
-    def _add_from_recs(_kwargs):
-        try:
-            recs = sp.recommendations(**_kwargs)
-            for t in recs.get("tracks", []):
-                u = t.get("uri")
-                if u and u not in seen:
-                    seen.add(u); bag.append(u)
-            return True
-        except SpotifyException:
-            return False
-        except Exception:
-            return False
+    # insertion-ordered dict doubles as the dedupe set
+    bag: dict[str, None] = {}
 
     # try full kwargs first
-    ok = _add_from_recs(kwargs)
+    ok = _recommendations_with_fallback(sp, kwargs, bag)
 
     # fallback 1: drop targets, keep seeds
     if not ok:
         slim = {"limit": kwargs["limit"], "market": DEFAULT_MARKET, **seeds}
-        ok = _add_from_recs(slim)
+        ok = _recommendations_with_fallback(sp, slim, bag)
 
     # fallback 2: if still nothing, try genres only (if any)
     if not ok and seed_genres:
-        ok = _add_from_recs({"limit": kwargs["limit"], "market": DEFAULT_MARKET, "seed_genres": seed_genres})
+        ok = _recommendations_with_fallback(
+            sp, {"limit": kwargs["limit"], "market": DEFAULT_MARKET, "seed_genres": seed_genres}, bag
+        )
 
     # ---- guarantee “must include” tracks from each selected artist ----
     if user_artist_ids:
@@ -473,20 +569,28 @@ def recommend_tracks(sp: Spotify, params: dict, n: int = 40) -> list[str]:
         target_total = max(8, min((n * 3) // 5, 28))
         per_artist = max(2, target_total // max(1, len(user_artist_ids)))
 
-        for aid in user_artist_ids[:5]:
-            try:
-                res = sp.artist_top_tracks(aid, country=DEFAULT_MARKET)
-                taken = 0
-                for t in res.get("tracks", []):
-                    if taken >= per_artist:
-                        break
-                    u = t.get("uri")
-                    if u and u not in seen:
-                        seen.add(u)
-                        bag.append(u)
-                        taken += 1
-            except Exception:
-                pass
+        # Fetch each artist's top tracks in parallel; collect into the bag
+        # serially afterwards so dedupe stays single-threaded
+        results = []
+        with ThreadPoolExecutor(max_workers=5) as ex:
+            futures = [
+                ex.submit(_fetch_limited, sp.artist_top_tracks, aid, country=DEFAULT_MARKET)
+                for aid in user_artist_ids[:5]
+            ]
+            for fut in as_completed(futures):
+                try:
+                    results.append(fut.result())
+                except Exception:
+                    pass
+        for res in results:
+            taken = 0
+            for t in res.get("tracks", []):
+                if taken >= per_artist:
+                    break
+                u = t.get("uri")
+                if u and u not in bag:
+                    bag[u] = None
+                    taken += 1
 
     # ---- search fallback if list is still short ----
     if len(bag) < n:
@@ -496,25 +600,28 @@ def recommend_tracks(sp: Spotify, params: dict, n: int = 40) -> list[str]:
             res = sp.search(q=q, type="track", limit=50, market=DEFAULT_MARKET)
             for t in res.get("tracks", {}).get("items", []):
                 u = t.get("uri")
-                if u and u not in seen:
-                    seen.add(u); bag.append(u)
+                if u:
+                    bag[u] = None
         except Exception:
             pass
 
+        uris = list(bag)
+
         # >>> NEW: de-SFX & vibe shaping pass <<<
-        filtered = _audio_feature_filter(sp, bag, params)
+        filtered, meta, feats = _audio_feature_filter(sp, uris, params)
 
         # If we filtered too aggressively, relax in stages:
         if len(filtered) < int(0.6 * n):
-            # allow instrumentals and widen tempo window
+            # allow instrumentals and widen tempo window; reuse the fetched
+            # meta/feats so the relax pass costs no extra API calls
             params_relaxed = dict(params)
             params_relaxed["instrumental_ok"] = True
             params_relaxed["vocals_required"] = False
-            filtered = _audio_feature_filter(sp, bag, params_relaxed)
+            filtered, _, _ = _audio_feature_filter(sp, uris, params_relaxed, meta=meta, feats=feats)
 
         if len(filtered) < int(0.4 * n):
             # last resort: only title/podcast filter
-            filtered = [u for u in bag if not _looks_like_sfx(u)]
+            filtered = [u for u in uris if not _looks_like_sfx(u)]
 
      # final shaping
     random.shuffle(filtered)
@@ -609,6 +716,31 @@ def _search_artist_by_genre(sp: Spotify, genre: str) -> dict | None:
 # In-process cache: { "genre": {"id","name","image","url"} }
 _GENRE_HERO_CACHE: dict[str, dict] = {}
 
+# Heroes are near-static (canonical artist per genre) — keep them a week
+_HERO_TTL = 7 * 86400
+
+def prime_genre_hero_cache() -> int:
+    """Load persisted heroes for the default seed genres into the in-process
+    cache so a restarted process serves the UI's initial view without any
+    Spotify round-trips. Returns how many were loaded."""
+    loaded = 0
+    for g in DEFAULT_SEED_GENRES:
+        if g in _GENRE_HERO_CACHE:
+            continue
+        data = cache_get_json(f"spotify:genre_hero:{g}")
+        if data:
+            _GENRE_HERO_CACHE[g] = data
+            loaded += 1
+    return loaded
+
+def prewarm_genre_heroes(sp: Spotify) -> None:
+    """Fetch any still-missing default-genre heroes with a real client.
+    Best-effort: called in the background once a user has connected."""
+    try:
+        get_genre_heroes(sp, sorted(DEFAULT_SEED_GENRES))
+    except Exception:
+        pass
+
 def get_genre_hero(sp: Spotify, genre: str) -> dict | None:
     g = (genre or "").strip().lower()
     if not g:
@@ -616,6 +748,12 @@ def get_genre_hero(sp: Spotify, genre: str) -> dict | None:
     if g in _GENRE_HERO_CACHE:
         return _GENRE_HERO_CACHE[g]
 
+    # Cross-process/restart cache
+    data = cache_get_json(f"spotify:genre_hero:{g}")
+    if data:
+        _GENRE_HERO_CACHE[g] = data
+        return data
+
     # Fast path: use canonical pick if available
     if g in _CANON:
         a = _safe_artist(sp, _CANON[g])
@@ -627,6 +765,7 @@ def get_genre_hero(sp: Spotify, genre: str) -> dict | None:
                 "url": a["external_urls"]["spotify"],
             }
             _GENRE_HERO_CACHE[g] = data
+            cache_set_json(f"spotify:genre_hero:{g}", data, ttl=_HERO_TTL)
             return data
 
     # Dynamic search / recs
@@ -639,6 +778,60 @@ def get_genre_hero(sp: Spotify, genre: str) -> dict | None:
             "url": a["external_urls"]["spotify"],
         }
         _GENRE_HERO_CACHE[g] = data
+        cache_set_json(f"spotify:genre_hero:{g}", data, ttl=_HERO_TTL)
         return data
 
-    return None
\ No newline at end of file
+    return None
+
+def _hero_from_artist(a: dict) -> dict:
+    return {
+        "id": a["id"],
+        "name": a["name"],
+        "image": _first_image_url(a),
+        "url": a["external_urls"]["spotify"],
+    }
+
+def get_genre_heroes(sp: Spotify, genres: list[str]) -> dict[str, dict]:
+    """
+    Batched get_genre_hero: cached/canonical genres resolve as before, and
+    the remaining misses share one genre:"a" OR genre:"b" search per group
+    of 5 instead of one round-trip each.
+    """
+    out: dict[str, dict] = {}
+    missing: list[str] = []
+    for genre in genres:
+        g = (genre or "").strip().lower()
+        if not g or g in out:
+            continue
+        if g in _GENRE_HERO_CACHE or g in _CANON:
+            hero = get_genre_hero(sp, g)
+            if hero:
+                out[g] = hero
+        else:
+            missing.append(g)
+
+    for i in range(0, len(missing), 5):
+        group = missing[i:i + 5]
+        try:
+            q = " OR ".join(f'genre:"{g}"' for g in group)
+            res = sp.search(q=q, type="artist", limit=50)
+            items = (res.get("artists", {}) or {}).get("items", []) or []
+        except Exception:
+            items = []
+        for g in group:
+            hero = None
+            # Partition the shared result set by each artist's genre tags
+            for a in items:
+                if _first_image_url(a) and any(g in ag.lower() for ag in (a.get("genres") or [])):
+                    hero = _hero_from_artist(a)
+                    break
+            if hero:
+                _GENRE_HERO_CACHE[g] = hero
+                cache_set_json(f"spotify:genre_hero:{g}", hero, ttl=_HERO_TTL)
+                out[g] = hero
+            else:
+                # fall back to the single-genre path (recs etc.)
+                hero = get_genre_hero(sp, g)
+                if hero:
+                    out[g] = hero
+    return out
\ No newline at end of file
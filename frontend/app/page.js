@@ -31,6 +31,7 @@ export default function Home() {
   const [username, setUsername] = useState("benijah");
   const [loading, setLoading] = useState(false);
   const [preview, setPreview] = useState("");
+  const [vibeParams, setVibeParams] = useState(null); // params from /playlist preview
   const [error, setError] = useState("");
 
   // Steering state
@@ -100,6 +101,7 @@ export default function Home() {
     e.preventDefault();
     setError("");
     setPreview("");
+    setVibeParams(null);
     if (!prompt.trim()) return;
 
     setLoading(true);
@@ -111,6 +113,7 @@ export default function Home() {
       if (!res.ok) throw new Error(`Backend error: ${res.status}`);
       const data = await res.json();
       setPreview(data.playlist_query || "(no response)");
+      setVibeParams(data.params || null);
     } catch (err) {
       setError(err.message || "Something went wrong.");
     } finally {
@@ -179,8 +182,11 @@ export default function Home() {
       limit: String(15), // current default; change if you add a slider
     });
     if (energy != null) qs.set("energy", String(energy));
+    // Reuse params cached from the preview so the backend skips a second LLM call
     const r = await fetch(`${API_BASE}/playlist/create?${qs.toString()}`, {
       method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(vibeParams),
     });
     const data = await r.json();
     if (data.playlist_url) {
@@ -207,7 +213,12 @@ export default function Home() {
           className="border rounded px-3 py-2"
           placeholder="Describe your vibe (e.g., rainy night drive)…"
           value={prompt}
-          onChange={(e) => setPrompt(e.target.value)}
+          onChange={(e) => {
+            setPrompt(e.target.value);
+            // params were computed for the old prompt — drop them so
+            // Create re-analyzes instead of steering with stale values
+            setVibeParams(null);
+          }}
         />
 
         {/* Genres: image grid */}